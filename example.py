@@ -33,8 +33,6 @@ def main():
     ]
     constraints = [{'distinct': ['Employees.emp_id']}]
 
-    env = Environment(schema, constraints, bound=2, time_budget=60)
-
     queries = [
         """
         SELECT emp_id FROM Employees WHERE age > 30
@@ -45,7 +43,8 @@ def main():
         """
     ]
 
-    eq, cex, checking_time, total_time, ret = env.check(*queries)
+    with Environment(schema, constraints, bound=2, time_budget=60) as env:
+        eq, cex, checking_time, total_time, ret = env.check(*queries)
     print(ret)
     if eq is None:
         print('ERR')
@@ -1,6 +1,8 @@
 from polygon.ast.expressions.expression import Expression
 
 class FilteredAggregate(Expression):
+    __slots__ = ('aggregate', 'condition')
+
     def __init__(self, aggregate, condition=None):
         self.aggregate = aggregate
         self.condition = condition
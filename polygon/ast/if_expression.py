@@ -2,6 +2,8 @@ from polygon.ast.expressions.expression import Expression
 from polygon.ast.node import Node
 
 class IfExpression(Expression):
+    __slots__ = ('condition', 'true_expr', 'false_expr')
+
     def __init__(self, condition: Expression, true_expr: Expression, false_expr: Expression):
         self.condition = condition
         self.true_expr = true_expr
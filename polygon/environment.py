@@ -1,9 +1,8 @@
 import datetime
-import traceback
-import multiprocess.pool
+import multiprocess
 import numpy as np
 
-from functools import cache
+from functools import lru_cache
 from typing import Tuple
 
 from polygon.ast.expressions.attribute import Attribute
@@ -24,6 +23,96 @@ from polygon.visitors.underapproximator import Underapproximator
 from polygon.visitors.visitor import Visitor
 
 
+_lower = lru_cache(maxsize=4096)(str.lower)
+
+
+@lru_cache(maxsize=None)
+def _parse_type(type_str: str) -> tuple:
+    """Split a schema type like 'enum,a,b' into its base type and enum values (None if not an enum)."""
+    base_type, *values = type_str.split(',')
+    if base_type == 'enum':
+        return base_type, tuple(values)
+    return base_type, None
+
+
+@lru_cache(maxsize=65536)
+def _compute_hash(string: str) -> int:
+    try:
+        return int(string)
+    except ValueError:
+        return hash(string)
+
+
+class _HashTable(dict):
+    """Maps strings to their hash, recording the reverse mapping on first lookup."""
+    __slots__ = ('reverse',)
+
+    def __init__(self, reverse: dict):
+        super().__init__()
+        self.reverse = reverse
+
+    def __missing__(self, string: str) -> int:
+        h = _compute_hash(string)
+        self[string] = h
+        self.reverse[h] = string
+        return h
+
+
+_parser = None
+
+
+def _get_parser() -> SQLParser:
+    # SQLParser keeps no per-query state, so a single instance is shared by all environments
+    global _parser
+    if _parser is None:
+        _parser = SQLParser()
+    return _parser
+
+
+# environment of a worker process, each worker only serves the environment that started it
+_worker_env = None
+
+
+def _run_task(init_args: tuple, constraints: list, task_name: str, args: tuple) -> dict:
+    """Run env.<task_name>(ret, *args) on the worker's environment for init_args and return ret."""
+    global _worker_env
+    # clear() rebuilds table schemas that hash and compare equal to the previous task's ones, so lookups
+    # memoized on those would hand back stale columns
+    TableSchema.__getitem__.cache_clear()
+
+    if _worker_env is None or _worker_env.init_args != init_args:
+        _worker_env = Environment(*init_args)
+    else:
+        # the schema and the cached 'ic' encoding are reused, only the previous task's encoding is dropped
+        _worker_env.clear()
+
+    env = _worker_env
+    if env.constraints != constraints:
+        # constraints were changed on the parent environment after it was created
+        env.constraints = list(constraints)
+        env.clear()
+
+    ret = {}
+    getattr(env, task_name)(ret, *args)
+    return ret
+
+
+def _serve_tasks(conn):
+    """Worker process loop: run each task received on conn and send back its ret dict until conn is closed."""
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+
+        try:
+            ret = _run_task(*task)
+        except Exception:
+            logger.exception("worker task failed")
+            ret = {'status': 'ERR', 'complete_time': datetime.datetime.now()}
+        conn.send(ret)
+
+
 class Environment:
     def __init__(self, schema, constraints, bound=2, time_budget=60, default_k=None):
         self.db = Database()
@@ -31,7 +120,9 @@ class Environment:
         self.table_id_counter = -1
 
         self.schema = schema
-        self.constraints = constraints
+        self.constraints = list(constraints)
+        # constructor arguments, workers build their own environment from these
+        self.init_args = (schema, list(constraints), bound, time_budget, default_k)
 
         self.time_budget = time_budget
         self.integrity_constraints = []
@@ -44,10 +135,13 @@ class Environment:
         self.size = SMTSize
         self.grouping = SMTGrouping
 
-        self.string_hash_table = {}
         self.hash_string_table = {}
+        self.string_hash_table = _HashTable(self.hash_string_table)
         self.curr_query_id = None
 
+        # (constraints, formula, integrity_constraints) of the last integrity constraint encoding
+        self.ic_cache = None
+
         # for testing
         self.unsat_mutants = []
         self.mutants = None
@@ -56,6 +150,11 @@ class Environment:
 
         self.stats = {}
 
+        # worker process and our end of its pipe, started on the first check and reused by later ones
+        self.worker = None
+        self.worker_conn = None
+        self.worker_tasks = 0
+
         self.load_schema(schema)
 
         self.underapproximator = Underapproximator(self)
@@ -86,124 +185,126 @@ class Environment:
                 'order by': 2
             }
 
-        self.formulas.append(encode_integrity_constraints(self.constraints, self), label='ic')
+        self.formulas.append(self.encode_ic(), label='ic')
+
+    def encode_ic(self):
+        # table ids are reassigned identically on every schema reload, so the encoding only changes with constraints
+        if self.ic_cache is None or self.ic_cache[0] != self.constraints:
+            formula = encode_integrity_constraints(self.constraints, self)
+            self.ic_cache = (list(self.constraints), formula, list(self.integrity_constraints))
+        else:
+            # restore what encode_foreign_key would have appended to the freshly reset list
+            self.integrity_constraints = list(self.ic_cache[2])
+        return self.ic_cache[1]
 
     def next_table_id(self) -> int:
         self.table_id_counter += 1
         return self.table_id_counter
 
     def string_hash(self, string: str) -> int:
-        if not isinstance(string, str):
-            string = str(string)
-
-        if string in self.string_hash_table:
-            return self.string_hash_table[string]
-
-        try:
-            h = int(string)
-        except:
-            h = hash(string)
-        self.string_hash_table[string] = h
-        self.hash_string_table[h] = string
-
-        return h
+        return self.string_hash_table[string]
 
     def lookup_string(self, string_hash: int) -> str:
-        if string_hash in self.hash_string_table:
-            return self.hash_string_table[string_hash]
+        string = self.hash_string_table.get(string_hash)
+        if string is not None:
+            return string
 
-        candidates = list(self.hash_string_table.values())
-        if len(candidates) > 0:
-            return candidates[string_hash % len(candidates)] + str(string_hash)
+        logger.debug(f"lookup_string miss: {string_hash}")
         return str(string_hash)
 
-    def load_schema(self, schema: list):
+    def load_schema(self, schema: list, add_constraints: bool = True):
         self.integrity_constraints = []
         enum_constraints = []
         for idx, table in enumerate(schema):
             table_id = self.next_table_id()
-            table_name = table["TableName"].lower()
+            table_name = _lower(table["TableName"])
             table_bound = self.bound_size
             table_schema = TableSchema(table_id, table_name, table_bound)
+            seen = set()
             column_id = 0
             for col in table['PKeys']:
-                column_name = col['Name'].lower()
-                data_type = col['Type'].split(',')[0]
-                if data_type == 'enum':
-                    enum = col['Type'].split(',')[1:]
-                    enum_constraints.append({'enum': [f'{table_name}.{column_name}', enum]})
+                column_name = _lower(col['Name'])
+                seen.add(column_name)
+                data_type, enum = _parse_type(col['Type'])
+                if enum is not None:
+                    enum_constraints.append({'enum': [f'{table_name}.{column_name}', list(enum)]})
                     data_type = 'varchar'
                 column_schema = ColumnSchema(column_id, column_name, data_type, table_name=table_name)
                 column_id += 1
                 table_schema.append(column_schema)
             for col in table['FKeys']:
-                column_name = col['FName'].lower()
-                has_column = False
-                for column in table_schema.columns:
-                    if column.column_name == column_name:
-                        has_column = True
-                        break
-                if has_column:
+                column_name = _lower(col['FName'])
+                if column_name in seen:
                     continue
+                seen.add(column_name)
                 p_table = int(col["PTable"])
                 p_name = col["PName"]
                 p_cols = schema[p_table]["PKeys"]
-                data_type = None
+                data_type, enum = None, None
                 for p_col in p_cols:
                     if p_col["Name"] == p_name:
-                        data_type = p_col["Type"].split(',')[0]
+                        data_type, enum = _parse_type(p_col["Type"])
                         break
-                if data_type == 'enum':
-                    enum = col['Type'].split(',')[1:]
-                    enum_constraints.append({'enum': [f'{table_name}.{column_name}', enum]})
+                if enum is not None:
+                    enum_constraints.append({'enum': [f'{table_name}.{column_name}', list(enum)]})
                     data_type = 'varchar'
                 column_schema = ColumnSchema(column_id, column_name, data_type, table_name=table_name)
-                if column_schema in table_schema:
-                    continue
                 column_id += 1
                 table_schema.append(column_schema)
             for col in table['Others']:
-                column_name = col['Name'].lower()
-                has_column = False
-                for column in table_schema.columns:
-                    if column.column_name == column_name:
-                        has_column = True
-                        break
-                if has_column:
+                column_name = _lower(col['Name'])
+                if column_name in seen:
                     continue
-                data_type = col['Type'].split(',')[0]
-                if data_type == 'enum':
-                    enum = col['Type'].split(',')[1:]
-                    enum_constraints.append({'enum': [f'{table_name}.{column_name}', enum]})
+                seen.add(column_name)
+                data_type, enum = _parse_type(col['Type'])
+                if enum is not None:
+                    enum_constraints.append({'enum': [f'{table_name}.{column_name}', list(enum)]})
                     data_type = 'varchar'
                 column_schema = ColumnSchema(column_id, column_name, data_type, table_name=table_name)
-                if column_schema in table_schema:
-                    continue
                 column_id += 1
                 table_schema.append(column_schema)
             self.db.add_table(table_schema)
             # self.formulas.append(And([self.size(table_id) >= Int(1), self.size(table_id) <= Int(table_bound)]), label=f'size_{table_name}')
-            self.constraints.extend(enum_constraints)
+
+        # schema-derived constraints are only added on the first load, reloads in clear() keep the existing ones
+        if not add_constraints:
+            return
+
+        self.constraints.extend(enum_constraints)
 
         # add integrity constraints from schema
         for idx, table in enumerate(schema):
-            table_name = table["TableName"].lower()
+            table_name = _lower(table["TableName"])
             if len(table['PKeys']) > 0:
                 self.constraints.append(
-                    {'primary': [f"{table_name}.{column['Name'].lower()}" for column in table['PKeys']]}
+                    {'primary': [f"{table_name}.{_lower(column['Name'])}" for column in table['PKeys']]}
                 )
 
             for col in table['FKeys']:
-                column_name = col['FName'].lower()
-                p_table_name = schema[int(col["PTable"])]["TableName"].lower()
-                p_name = col["PName"].lower()
+                column_name = _lower(col['FName'])
+                p_table_name = _lower(schema[int(col["PTable"])]["TableName"])
+                p_name = _lower(col["PName"])
                 self.constraints.append(
                     {'eq': [f"{table_name}.{column_name}", f"{p_table_name}.{p_name}"]}
                 )
 
+    def encode_queries(self, asts) -> list:
+        # queries are encoded one after another: QueryEncoder allocates table ids, database tables and formula
+        # labels on this environment, and curr_query_id scopes table name lookups to the query being encoded
+        outputs = []
+        for query_id, ast in enumerate(asts):
+            self.curr_query_id = query_id
+            # print(repr(ast))
+            encoder = QueryEncoder(self)
+            output = ast.accept(encoder)
+            outputs.append(output)
+            # print(output.node.label)
+        self.initialized = True
+        return outputs
+
     def check(self, q1, q2, use_precise_encoding=False):
         # parse
-        parser = SQLParser()
+        parser = _get_parser()
 
         jsons = []
         for query in [q1, q2]:
@@ -213,199 +314,63 @@ class Environment:
         for j in jsons:
             asts.append(parser.parse_query(j))
 
+        # syntactically identical queries are trivially equivalent and skip the solver, but one of them is still
+        # encoded so that unknown tables or columns are reported as 'ERR' as for any other pair
+        if jsons[0] == jsons[1]:
+            start = datetime.datetime.now()
+            try:
+                self.encode_queries(asts[:1])
+            except Exception:
+                logger.exception("failed to encode queries")
+                return None, None, None, None, {'status': 'ERR', 'complete_time': datetime.datetime.now()}
+            finally:
+                self.clear()
+
+            complete_time = datetime.datetime.now()
+            total_time = (complete_time - start).total_seconds()
+            return True, None, None, total_time, {'status': 'EQU', 'complete_time': complete_time, 'total_time': total_time}
+
         # initializer = Initializer(self)
         #
         # for ast in asts:
         #     ast.accept(initializer)
 
-        def task(ret):
-            start = datetime.datetime.now()
+        start = datetime.datetime.now()
+        ret = self.run_task('check_task', asts, use_precise_encoding)
 
-            checking_time = 0
-            unsat_core_time = 0
-            max_rounds = 9000
-            cur_rounds = 0
-            size_unsat_core = 0
-            raw_size_unsat_core = 0
-
-            while True:
-                try:
-                    outputs = []
-                    for query_id, ast in enumerate(asts):
-                        self.curr_query_id = query_id
-                        # print(repr(ast))
-                        encoder = QueryEncoder(self)
-                        output = ast.accept(encoder)
-                        outputs.append(output)
-                        # print(output.node.label)
-                    self.initialized = True
-
-                    self.formulas.append(Not(self.o1_eq_o2(outputs[0], outputs[1])), label='neq')
-                except Exception as e:
-                    logger.error(''.join(traceback.format_tb(e.__traceback__)) + str(e))
-                    ret['status'] = 'ERR'
-                    return
-
-                # self.formulas.append(And(self.underapproximator.underapproximation_constraints), label='op_under')
-
-                try:
-                    if not use_precise_encoding:
-                        succeed_prover = self.formulas.search(outputs, ret)
-                    else:
-                        succeed_prover = self.formulas.solve_precise(ret)
-
-                    total_time = (datetime.datetime.now() - start).total_seconds()
-                    ret['complete_time'] = datetime.datetime.now()
-                    ret['total_time'] = total_time
-                    if succeed_prover is None:
-                        ret['status'] = 'EQU'
-                        return
-                    checking_time += succeed_prover.checking_time
-                except Exception as e:
-                    logger.error(''.join(traceback.format_tb(e.__traceback__)) + str(e))
-                    ret['status'] = 'ERR'
-                    return
-
-                # debug: print final outputs
-                for output in outputs:
-                    logger.debug(succeed_prover.evaluate_table(output, self.db, self))
-
-                # debug: print all intermediate table outputs
-                # for table in self.db.schemas.values():
-                #     print(table.table_id, table.lineage)
-                #     print(succeed_prover.evaluate_choice_vector(table))
-                #     print(succeed_prover.evaluate_table(table, self.db, self))
-                #     print('=' * 30)
-
-                database = {}
-                try:
-                    for table_idx, _ in enumerate(self.schema):
-                        database[self.schema[table_idx]["TableName"].lower()] = succeed_prover.evaluate_table(
-                            self.db.schemas[table_idx],
-                            self.db,
-                            self
-                        )
-
-                    ret['status'] = 'NEQ'
-                    ret['cex'] = database
-
-                except Exception as e:
-                    logger.error(''.join(traceback.format_tb(e.__traceback__)) + str(e))
-                    ret['status'] = 'ERR'
-                    return
+        if ret['status'] == 'ERR':
+            return None, None, None, None, ret
 
-                break
+        total_time = (ret['complete_time'] - start).total_seconds()
 
-        with multiprocess.Manager() as manager:
-            ret = manager.dict()
-
-            process = multiprocess.Process(target=task, args=(ret,))
-            process.start()
-
-            start = datetime.datetime.now()
-            process.join(self.time_budget)
-
-            if process.is_alive():
-                process.terminate()
-                ret['status'] = 'TMO'
-                ret['complete_time'] = datetime.datetime.now()
-
-            if ret['status'] == 'ERR':
-                return None, None, None, None, dict(ret)
-
-            total_time = (ret['complete_time'] - start).total_seconds()
-
-            self.clear()
-
-            # print(ret)
-
-            if ret['status'] == 'NEQ':
-                return False, ret['cex'], None, total_time, dict(ret)
-            elif ret['status'] == 'TMO':
-                return None, None, None, total_time, dict(ret)
-            else:
-                return True, None, None, total_time, dict(ret)
-
-    def disambiguate(self, queries, group_range, use_precise_encoding=False):
-        parser = SQLParser()
-
-        jsons = []
-        for query in queries:
-            jsons.append(parser.parse(query))
+        self.clear()
 
-        asts = []
-        for j in jsons:
-            asts.append(parser.parse_query(j))
+        # print(ret)
 
-        # initializer = Initializer(self)
-        #
-        # for ast in asts:
-        #     ast.accept(initializer)
+        if ret['status'] == 'NEQ':
+            return False, ret['cex'], None, total_time, ret
+        elif ret['status'] == 'TMO':
+            return None, None, None, total_time, ret
+        else:
+            return True, None, None, total_time, ret
 
-        def task(ret):
-            start = datetime.datetime.now()
+    def check_task(self, ret, asts, use_precise_encoding):
+        start = datetime.datetime.now()
 
-            checking_time = 0
+        checking_time = 0
+        unsat_core_time = 0
+        max_rounds = 9000
+        cur_rounds = 0
+        size_unsat_core = 0
+        raw_size_unsat_core = 0
 
+        while True:
             try:
-                outputs = []
-                for query_id, ast in enumerate(asts):
-                    self.curr_query_id = query_id
-                    # print(repr(ast))
-                    encoder = QueryEncoder(self)
-                    output = ast.accept(encoder)
-                    outputs.append(output)
-                    # print(output.node.label)
-                self.initialized = True
-
-                disambiguation_cond = []
-
-                num_groups = 2
-
-                pre_created_o = [
-                    create_empty_table(
-                        row=max(outputs, key=lambda o: o.bound).bound,
-                        col=len(max(outputs, key=lambda o: len(o.columns)).columns),
-                        env=self)
-                    for _ in range(num_groups)
-                ]
-
-                for q_output in outputs:
-                    disambiguation_cond.append(
-                        Or([SMTBelongsToGroup(q_output.table_id, g) for g in range(num_groups)])
-                    )
+                outputs = self.encode_queries(asts)
 
-                    indicators = []
-                    for g in range(num_groups):
-                        disambiguation_cond.append(
-                            Implies(
-                                SMTBelongsToGroup(q_output.table_id, g),
-                                self.o1_eq_o2(q_output, pre_created_o[g])
-                            )
-                        )
-                        indicators.append(If(SMTBelongsToGroup(q_output.table_id, g), Int(1), Int(0)))
-                    disambiguation_cond.append(Sum(indicators) == Int(1))
-
-                for g in range(num_groups):
-                    indicators = []
-                    for q_output in outputs:
-                        indicators.append(If(SMTBelongsToGroup(q_output.table_id, g), Int(1), Int(0)))
-                    disambiguation_cond.append(
-                        And([
-                            Sum(indicators) >= Int(max(len(outputs) / num_groups - group_range, 1)),
-                            Sum(indicators) <= Int(len(outputs) / num_groups + group_range),
-                        ])
-                    )
-
-                for g in range(num_groups):
-                    for another_g in range(num_groups):
-                        if another_g == g:
-                            continue
-                        disambiguation_cond.append(Not(self.o1_eq_o2(pre_created_o[g], pre_created_o[another_g])))
-
-                self.formulas.append(And(disambiguation_cond), label='disambiguation')
-            except Exception as e:
-                logger.error(''.join(traceback.format_tb(e.__traceback__)) + str(e))
+                self.formulas.append(Not(self.o1_eq_o2(outputs[0], outputs[1])), label='neq')
+            except Exception:
+                logger.exception("failed to encode queries")
                 ret['status'] = 'ERR'
                 return
 
@@ -424,11 +389,22 @@ class Environment:
                     ret['status'] = 'EQU'
                     return
                 checking_time += succeed_prover.checking_time
-            except Exception as e:
-                logger.error(''.join(traceback.format_tb(e.__traceback__)) + str(e))
+            except Exception:
+                logger.exception("failed to solve")
                 ret['status'] = 'ERR'
                 return
 
+            # debug: print final outputs
+            for output in outputs:
+                logger.debug(succeed_prover.evaluate_table(output, self.db, self))
+
+            # debug: print all intermediate table outputs
+            # for table in self.db.schemas.values():
+            #     print(table.table_id, table.lineage)
+            #     print(succeed_prover.evaluate_choice_vector(table))
+            #     print(succeed_prover.evaluate_table(table, self.db, self))
+            #     print('=' * 30)
+
             database = {}
             try:
                 for table_idx, _ in enumerate(self.schema):
@@ -441,109 +417,271 @@ class Environment:
                 ret['status'] = 'NEQ'
                 ret['cex'] = database
 
-            except Exception as e:
-                logger.error(''.join(traceback.format_tb(e.__traceback__)) + str(e))
+            except Exception:
+                logger.exception("failed to extract counterexample")
                 ret['status'] = 'ERR'
                 return
 
-        with multiprocess.Manager() as manager:
-            ret = manager.dict()
+            break
 
-            process = multiprocess.Process(target=task, args=(ret,))
-            process.start()
+    def disambiguate(self, queries, group_range, use_precise_encoding=False):
+        parser = _get_parser()
 
-            start = datetime.datetime.now()
-            process.join(self.time_budget)
+        jsons = []
+        for query in queries:
+            jsons.append(parser.parse(query))
 
-            if process.is_alive():
-                process.terminate()
-                ret['status'] = 'TMO'
-                ret['complete_time'] = datetime.datetime.now()
+        asts = []
+        for j in jsons:
+            asts.append(parser.parse_query(j))
+
+        # initializer = Initializer(self)
+        #
+        # for ast in asts:
+        #     ast.accept(initializer)
 
-            total_time = (ret['complete_time'] - start).total_seconds()
+        start = datetime.datetime.now()
+        ret = self.run_task('disambiguate_task', asts, group_range, use_precise_encoding)
 
-            self.clear()
+        total_time = (ret['complete_time'] - start).total_seconds()
 
-            # print(ret)
+        self.clear()
 
-            if ret['status'] == 'ERR':
-                return None, None, None, total_time, dict(ret)
+        # print(ret)
+
+        if ret['status'] == 'ERR':
+            return None, None, None, total_time, ret
+        else:
+            if ret['status'] == 'NEQ':
+                return False, ret['cex'], None, total_time, ret
+            elif ret['status'] == 'TMO':
+                return None, None, None, total_time, ret
             else:
-                if ret['status'] == 'NEQ':
-                    return False, ret['cex'], None, total_time, dict(ret)
-                elif ret['status'] == 'TMO':
-                    return None, None, None, total_time, dict(ret)
-                else:
-                    return True, None, None, total_time, dict(ret)
+                return True, None, None, total_time, ret
+
+    def disambiguate_task(self, ret, asts, group_range, use_precise_encoding):
+        start = datetime.datetime.now()
+
+        checking_time = 0
+
+        try:
+            outputs = self.encode_queries(asts)
+
+            num_groups = 2
+            groups = range(num_groups)
+
+            pre_created_o = [
+                create_empty_table(
+                    row=max(outputs, key=lambda o: o.bound).bound,
+                    col=len(max(outputs, key=lambda o: len(o.columns)).columns),
+                    env=self)
+                for _ in groups
+            ]
+
+            # every output belongs to some group
+            belongs = [Or([SMTBelongsToGroup(o.table_id, g) for g in groups]) for o in outputs]
+            # outputs in the same group are equal to its representative
+            implications = [
+                Implies(SMTBelongsToGroup(o.table_id, g), self.o1_eq_o2(o, pre_created_o[g]))
+                for o in outputs for g in groups
+            ]
+            # each output belongs to exactly one group
+            exactly_one = [
+                Sum([If(SMTBelongsToGroup(o.table_id, g), Int(1), Int(0)) for g in groups]) == Int(1)
+                for o in outputs
+            ]
+            # groups are roughly balanced
+            group_sizes = [Sum([If(SMTBelongsToGroup(o.table_id, g), Int(1), Int(0)) for o in outputs]) for g in groups]
+            balanced = [
+                And([
+                    group_size >= Int(max(len(outputs) / num_groups - group_range, 1)),
+                    group_size <= Int(len(outputs) / num_groups + group_range),
+                ])
+                for group_size in group_sizes
+            ]
+            # group representatives are pairwise different, equality is symmetric so each pair is encoded once
+            distinct_groups = [
+                Not(self.o1_eq_o2(pre_created_o[g], pre_created_o[another_g]))
+                for g in groups for another_g in range(g + 1, num_groups)
+            ]
+
+            disambiguation_cond = belongs + implications + exactly_one + balanced + distinct_groups
+            self.formulas.append(And(disambiguation_cond), label='disambiguation')
+        except Exception:
+            logger.exception("failed to encode queries")
+            ret['status'] = 'ERR'
+            return
+
+        # self.formulas.append(And(self.underapproximator.underapproximation_constraints), label='op_under')
+
+        try:
+            if not use_precise_encoding:
+                succeed_prover = self.formulas.search(outputs, ret)
+            else:
+                succeed_prover = self.formulas.solve_precise(ret)
+
+            total_time = (datetime.datetime.now() - start).total_seconds()
+            ret['complete_time'] = datetime.datetime.now()
+            ret['total_time'] = total_time
+            if succeed_prover is None:
+                ret['status'] = 'EQU'
+                return
+            checking_time += succeed_prover.checking_time
+        except Exception:
+            logger.exception("failed to solve")
+            ret['status'] = 'ERR'
+            return
+
+        database = {}
+        try:
+            for table_idx, _ in enumerate(self.schema):
+                database[self.schema[table_idx]["TableName"].lower()] = succeed_prover.evaluate_table(
+                    self.db.schemas[table_idx],
+                    self.db,
+                    self
+                )
+
+            ret['status'] = 'NEQ'
+            ret['cex'] = database
+
+        except Exception:
+            logger.exception("failed to extract counterexample")
+            ret['status'] = 'ERR'
+            return
+
+    def run_task(self, task_name: str, *args) -> dict:
+        """Run <task_name>(ret, *args) in the worker process and return the ret dict it filled in."""
+        if self.worker is not None and not self.worker.is_alive():
+            self.close()
+
+        if self.worker is None:
+            self.worker_conn, worker_conn = multiprocess.Pipe()
+            self.worker = multiprocess.Process(target=_serve_tasks, args=(worker_conn,), daemon=True)
+            self.worker.start()
+            worker_conn.close()
+            self.worker_tasks = 0
+
+        self.worker_conn.send((self.init_args, self.constraints, task_name, args))
+
+        if not self.worker_conn.poll(self.time_budget):
+            self.close()
+            return {'status': 'TMO', 'complete_time': datetime.datetime.now()}
+
+        try:
+            ret = self.worker_conn.recv()
+        except EOFError:
+            # the worker died before sending a result, e.g. the solver crashed the process
+            self.close()
+            return {'status': 'ERR', 'complete_time': datetime.datetime.now()}
+
+        # replace the worker now and then so that memory it has grown is given back
+        self.worker_tasks += 1
+        if self.worker_tasks >= 64:
+            self.close()
+
+        return ret
+
+    def close(self):
+        if self.worker is not None:
+            self.worker_conn.close()
+            self.worker.terminate()
+            self.worker.join()
+            self.worker = None
+            self.worker_conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def o1_eq_o2(self, o1, o2):
-        def f_multiplicity(r, t):
+        null, cell = self.null, self.cell
+        # Not(Deleted(...)) of every tuple, shared by all the terms below
+        o1_kept = [Not(Deleted(o1.table_id, tuple_id)) for tuple_id in range(o1.bound)]
+        o2_kept = [Not(Deleted(o2.table_id, tuple_id)) for tuple_id in range(o2.bound)]
+
+        def f_multiplicity(r, r_kept, t):
+            table_id = r.table_id
+            column_ids = [column.column_id for column in r]
+            t_nulls = [null(*identity) for identity in t]
+            t_cells = [cell(*identity) for identity in t]
             indicators = []
             for tuple_idx in range(r.bound):
-                tuple_eq = [Not(Deleted(r.table_id, tuple_idx))]
-                for column_idx, column in enumerate(r):
+                tuple_eq = [r_kept[tuple_idx]]
+                for column_idx, column_id in enumerate(column_ids):
+                    r_null = null(table_id, tuple_idx, column_id)
+                    t_null = t_nulls[column_idx]
                     tuple_eq.append(Or([
-                        And([self.null(r.table_id, tuple_idx, column.column_id), self.null(*t[column_idx])]),
+                        And([r_null, t_null]),
                         And([
-                            Not(Or([self.null(r.table_id, tuple_idx, column.column_id), self.null(*t[column_idx])])),
-                            self.cell(r.table_id, tuple_idx, column.column_id) == self.cell(*t[column_idx])
+                            Not(Or([r_null, t_null])),
+                            cell(table_id, tuple_idx, column_id) == t_cells[column_idx]
                         ])
                     ]))
                 indicators.append(If(And(tuple_eq), Int(1), Int(0)))
             return Sum(indicators)
 
-        o1_size = Sum([If(Not(Deleted(o1.table_id, tuple_id)), Int(1), Int(0)) for tuple_id in range(o1.bound)])
-        o2_size = Sum([If(Not(Deleted(o2.table_id, tuple_id)), Int(1), Int(0)) for tuple_id in range(o2.bound)])
-
         if len(o1.columns) == len(o2.columns):
+            o1_size = Sum([If(kept, Int(1), Int(0)) for kept in o1_kept])
+            o2_size = Sum([If(kept, Int(1), Int(0)) for kept in o2_kept])
+
             lateral_bag_eq = []
             for tuple_id in range(o1.bound):
+                t = [(o1.table_id, tuple_id, column.column_id) for column in o1]
                 lateral_bag_eq.append(
                     Implies(
-                        Not(Deleted(o1.table_id, tuple_id)),
-                        f_multiplicity(o1, [(o1.table_id, tuple_id, column.column_id) for column in o1]) ==
-                        f_multiplicity(o2, [(o1.table_id, tuple_id, column.column_id) for column in o1])
+                        o1_kept[tuple_id],
+                        f_multiplicity(o1, o1_kept, t) == f_multiplicity(o2, o2_kept, t)
                     )
                 )
             f = [o1_size == o2_size, And(lateral_bag_eq)]
 
             # sorted columns are equivalent under list semantics
-            if o1.lineage is not None and o2.lineage is not None and 'Sorted' in o1.lineage and 'Sorted' in o2.lineage:
-                sorted_columns_list_eq = []
-                o1_encoder = ExpressionEncoder(o1, self)
-                o2_encoder = ExpressionEncoder(o2, self)
-                for tuple_id in range(min(o1.bound, o2.bound)):
-                    for expression_idx, expression in enumerate(o1.node.expressions):
-                        if isinstance(expression, Literal):
-                            if isinstance(expression.value, bool):
-                                continue
-                            o1_cell = self.db[o1.table_id, tuple_id, expression.value - 1]
-                            o1_cell = o1_cell.VAL, o1_cell.NULL
-                            o2_cell = self.db[o2.table_id, tuple_id, expression.value - 1]
-                            o2_cell = o2_cell.VAL, o2_cell.NULL
-                        else:
-                            if isinstance(expression, Attribute) and '.' in expression.name:
-                                expression = Attribute(expression.name.split('.')[1])
-                            o1_cell = o1_encoder.expression_for_tuple(expression, tuple_id)
-                            o2_cell = o2_encoder.expression_for_tuple(expression, tuple_id)
-
-                        VAL, NULL = 0, 1
-                        sorted_columns_list_eq.append(
-                            Implies(
-                                Not(Deleted(o1.table_id, tuple_id)),
-                                Or([
-                                    And([o1_cell[NULL], o2_cell[NULL]]),
-                                    And([
-                                        Not(Or([o1_cell[NULL], o2_cell[NULL]])),
-                                        o1_cell[VAL] == o2_cell[VAL]
+            if o1.is_sorted() and o2.is_sorted():
+                # normalize the sorting expressions once rather than once per tuple
+                sorting_expressions = []
+                for expression in o1.node.expressions:
+                    if isinstance(expression, Literal):
+                        if isinstance(expression.value, bool):
+                            continue
+                    elif isinstance(expression, Attribute) and '.' in expression.name:
+                        expression = Attribute(expression.name.split('.')[1])
+                    sorting_expressions.append(expression)
+
+                if sorting_expressions:
+                    sorted_columns_list_eq = []
+                    o1_encoder = ExpressionEncoder(o1, self)
+                    o2_encoder = ExpressionEncoder(o2, self)
+                    for tuple_id in range(min(o1.bound, o2.bound)):
+                        for expression in sorting_expressions:
+                            if isinstance(expression, Literal):
+                                o1_cell = self.db[o1.table_id, tuple_id, expression.value - 1]
+                                o1_cell = o1_cell.VAL, o1_cell.NULL
+                                o2_cell = self.db[o2.table_id, tuple_id, expression.value - 1]
+                                o2_cell = o2_cell.VAL, o2_cell.NULL
+                            else:
+                                o1_cell = o1_encoder.expression_for_tuple(expression, tuple_id)
+                                o2_cell = o2_encoder.expression_for_tuple(expression, tuple_id)
+
+                            VAL, NULL = 0, 1
+                            sorted_columns_list_eq.append(
+                                Implies(
+                                    o1_kept[tuple_id],
+                                    Or([
+                                        And([o1_cell[NULL], o2_cell[NULL]]),
+                                        And([
+                                            Not(Or([o1_cell[NULL], o2_cell[NULL]])),
+                                            o1_cell[VAL] == o2_cell[VAL]
+                                        ])
                                     ])
-                                ])
+                                )
                             )
-                        )
-                f.append(And(sorted_columns_list_eq))
+                    f.append(And(sorted_columns_list_eq))
             return And(f)
         else:
-            return Or([o1_size > Int(0), o2_size > Int(0)])
+            # at least one output keeps a tuple, without summing tuple indicators
+            return Or(o1_kept + o2_kept)
 
     def copy_cell(self, original_cell, new_cell):
         return And([
@@ -554,15 +692,15 @@ class Environment:
     def clear(self):
         self.db = Database()
         self.table_id_counter = -1
-        self.string_hash_table = {}
-        self.hash_string_table = {}
+        # interned strings are kept so that those hashed by a cached 'ic' encoding can still be looked up
 
         self.formulas = FormulaManager(self)
 
         self.unsat_mutants = []
 
-        self.load_schema(self.schema)
-        self.formulas.append(encode_integrity_constraints(self.constraints, self), label='ic')
+        self.load_schema(self.schema, add_constraints=False)
+        self.formulas.append(self.encode_ic(), label='ic')
         # self.formulas.append(And(self.integrity_constraints), label='ic')
 
-        self.underapproximator = Underapproximator(self)
\ No newline at end of file
+        self.underapproximator = Underapproximator(self)
+        self.initialized = False
\ No newline at end of file
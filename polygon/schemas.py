@@ -44,6 +44,9 @@ class TableSchema:
     def get_info(self):
         return self.table_id, self.table_name
 
+    def is_sorted(self):
+        return self.lineage is not None and self.lineage.startswith('Sorted')
+
     def as_aliased(self, alias, env):
         if 'Scan' in self.lineage:
             new_table_id = env.next_table_id()
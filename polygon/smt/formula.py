@@ -423,7 +423,7 @@ class FormulaManager:
         table = self.env.db.schemas[self.label_to_table_id[node_label]]
         vec_size = table.bound
 
-        if 'Sorted' in table.lineage:
+        if table.is_sorted():
             yield ['T'] * vec_size
         elif left_right_tops is not None and left_right_tops * 2 < vec_size:
             for cover in [list(x) for x in itertools.product([0, 1], repeat=vec_size - left_right_tops * 2)]:
@@ -244,6 +244,17 @@ class SMTLIBv2:
         table_id = table.table_id
         cex.append([column.column_name for column in db.schemas[table_id]])
 
+        # normalize column types once per column instead of once per cell
+        columns = []
+        for column in db.schemas[table_id]:
+            if column.column_type is None:
+                column_type = 'int'
+            else:
+                column_type = column.column_type.lower()
+            if 'char' in column_type:
+                column_type = 'varchar'
+            columns.append((column.column_id, column_type))
+
         for tuple_id in range(table.bound):
             # print(f'choice({table_id}, {tuple_id})', self.evaluate('choice', [table_id, tuple_id]))
 
@@ -254,17 +265,11 @@ class SMTLIBv2:
                 continue
 
             row = []
-            for column in db.schemas[table_id]:
-                if self.evaluate('null', [table_id, tuple_id, column.column_id]) == 'true':
+            for column_id, column_type in columns:
+                if self.evaluate('null', [table_id, tuple_id, column_id]) == 'true':
                     row.append(None)
                 else:
-                    value = int(self.evaluate('cell', [table_id, tuple_id, column.column_id]))
-                    if column.column_type is None:
-                        column_type = 'int'
-                    else:
-                        column_type = column.column_type.lower()
-                    if 'char' in column_type:
-                        column_type = 'varchar'
+                    value = int(self.evaluate('cell', [table_id, tuple_id, column_id]))
                     match column_type:
                         case 'varchar' | 'text':
                             row.append(env.lookup_string(value))
@@ -59,10 +59,10 @@ class Database:
 
     def find_table_by_name(self, name: str, env) -> TableSchema:
         name = name.lower()
-        for table in self.schemas:
-            if self.schemas[table].table_name.lower() == name.lower():
-                if self.schemas[table].scope is None or self.schemas[table].scope == env.curr_query_id:
-                    return self.schemas[table]
+        for schema in self.schemas.values():
+            if schema.table_name.lower() == name:
+                if schema.scope is None or schema.scope == env.curr_query_id:
+                    return schema
 
         raise SyntaxError(f"Table '{name}' does not exist")
 